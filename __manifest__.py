@@ -4,9 +4,10 @@
     'category': 'Accounting',
     'summary': 'Test Z-Credit payment gateway integration',
     'author': 'Developer',
-    'depends': ['base', 'account'],
+    'depends': ['base', 'account', 'queue_job'],
     'data': [
         'security/ir.model.access.csv',
+        'data/ir_sequence_data.xml',
         'views/zcredit_transaction_views.xml',
     ],
     'installable': True,
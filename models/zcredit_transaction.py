@@ -1,15 +1,115 @@
 # -*- coding: utf-8 -*-
 import json
 import logging
-import re
-from odoo import models, fields, api, _
+from odoo import models, fields, api, _, _lt
 from odoo.exceptions import ValidationError
 import requests
+from psycopg2.errors import UniqueViolation
+from requests.adapters import HTTPAdapter, Retry
 from requests.exceptions import Timeout, ConnectionError, RequestException
 from datetime import date
 
 _logger = logging.getLogger(__name__)
 
+# Optional fast JSON codec: orjson parses/serializes several times faster than
+# the stdlib; its JSONDecodeError subclasses json.JSONDecodeError, so the
+# existing except clauses keep working with either implementation.
+try:
+    import orjson
+
+    def _dumps(obj):
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2, default=str).decode()
+
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(obj):
+        return json.dumps(obj, indent=2, ensure_ascii=False, default=str)
+
+    _loads = json.loads
+
+# Optional streaming parser: with ijson installed, responses are parsed
+# incrementally from the raw socket and only the status fields are built
+# into Python objects; the raw bytes are teed off the stream so the body
+# stays available for the result field and for error reporting.
+try:
+    import ijson
+    # ijson's errors do not subclass json.JSONDecodeError (orjson's do)
+    _DECODE_ERRORS = (json.JSONDecodeError, ijson.common.JSONError)
+except ImportError:
+    ijson = None
+    _DECODE_ERRORS = (json.JSONDecodeError,)
+
+# Top-level response keys needed to decide the transaction outcome
+_STATUS_FIELDS = frozenset({'HasError', 'ReturnCode', 'ReturnMessage', 'ApprovalNumber'})
+
+
+class _TeeReader:
+    """File-like wrapper that keeps a copy of everything read.
+
+    Lets the streaming parser consume the socket while the raw body
+    remains available, including whatever was read before a parse error.
+    """
+
+    def __init__(self, raw):
+        self._raw = raw
+        self._chunks = []
+
+    def read(self, size=-1):
+        chunk = self._raw.read(size)
+        if chunk:
+            self._chunks.append(chunk)
+        return chunk
+
+    def text(self, encoding=None):
+        return b''.join(self._chunks).decode(encoding or 'utf-8', errors='replace')
+
+# Shared HTTP session: keep-alive amortizes the TCP + TLS handshake across transactions
+_SESSION = requests.Session()
+_SESSION.mount('https://', HTTPAdapter(
+    pool_connections=8,
+    pool_maxsize=32,
+    max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504]),
+))
+
+def _reformat_response(response_text):
+    """Parse and pretty-print a gateway response."""
+    parsed = _loads(response_text)
+    return _dumps(parsed), parsed
+
+
+# Constraint messages, built once at import and translated lazily at raise time
+_ERR_AMOUNT = _lt("Transaction amount must be a positive number.")
+_ERR_CARD_FORMAT = _lt("Invalid Card Number format. Must be 13-19 digits.")
+_ERR_CARD_LUHN = _lt("Invalid Card Number (Luhn check failed).")
+_ERR_EXPIRY_FORMAT = _lt("Invalid Expiry Date format. Must be MM/YY.")
+_ERR_EXPIRY_MONTH = _lt("Invalid Expiry Month (must be 01-12).")
+_ERR_EXPIRED = _lt("Card is expired.")
+_ERR_CVV = _lt("Invalid CVV. Must be 3 or 4 digits.")
+_ERR_CARD_BLOCKED = _lt("This card has been reported stolen and cannot be processed.")
+
+# Known-bad card numbers; frozenset gives an O(1) membership check with
+# no per-call allocation. A real BIN blocklist would live in the database.
+_STOLEN_CARDS = frozenset({'4532015112830366', '5425233010103442'})
+
+# CommitFullTransaction payload skeleton; copying a pre-sized dict avoids
+# rebuilding (and re-growing) the literal on every request
+_PAYLOAD_TEMPLATE = {
+    # Credentials
+    'TerminalNumber': None,
+    'password': None,
+    # Card Data
+    'CardNumber': None,
+    'ExpDate_MMYY': None,
+    'CVV': None,
+    'CardHolderName': None,
+    # Transaction Data
+    'TransactionSum': 0.0,
+    'J': 0,
+}
+
+# Luhn doubled-digit lookup table: _LUHN[d] == d*2 if d*2 < 10 else d*2 - 9
+_LUHN = (0, 2, 4, 6, 8, 1, 3, 5, 7, 9)
+
 
 class ZCreditTransaction(models.Model):
     _name = 'zcredit.transaction'
@@ -47,61 +147,124 @@ class ZCreditTransaction(models.Model):
         ('processing', 'Processing'),
         ('success', 'Success'),
         ('failed', 'Failed'),
-    ], string='Status', default='draft', required=True, tracking=True, copy=False)
+    ], string='Status', default='draft', required=True, tracking=True, copy=False, index=True)
 
     # Odoo Overrides and Sequence
+    @api.model
+    def _next_references(self, count):
+        """Claim `count` sequence numbers, in one query where possible.
+
+        next_by_code() round-trips to Postgres (and locks the sequence)
+        once per call; for standard sequences the numbers are claimed
+        with a single nextval() over generate_series and formatted with
+        the sequence's own prefix, padding and suffix. Non-standard
+        sequences fall back to per-record next_by_code().
+        """
+        seq = self.env['ir.sequence'].search([('code', '=', 'zcredit.transaction')], limit=1)
+        # Date-range sequences draw from per-range Postgres sequences, not
+        # the parent one, so they must take the next_by_code() path below.
+        if count > 1 and seq and seq.implementation == 'standard' and not seq.use_date_range:
+            self.env.cr.execute(
+                "SELECT nextval(%s) FROM generate_series(1, %s)",
+                ('ir_sequence_%03d' % seq.id, count),
+            )
+            prefix, suffix = seq._get_prefix_suffix()
+            return ["%s%0*d%s" % (prefix, seq.padding, number, suffix)
+                    for (number,) in self.env.cr.fetchall()]
+        return [self.env['ir.sequence'].next_by_code('zcredit.transaction') or _('New')
+                for _unused in range(count)]
+
     @api.model_create_multi
     def create(self, vals_list):
-        for vals in vals_list:
-            if vals.get('name', _('New')) == _('New'):
-                vals['name'] = self.env['ir.sequence'].next_by_code('zcredit.transaction') or _('New')
-        return super().create(vals_list)
+        to_name = [vals for vals in vals_list if vals.get('name', _('New')) == _('New')]
+        for vals, name in zip(to_name, self._next_references(len(to_name))):
+            vals['name'] = name
+        # Skip the creator auto-subscription; these records are operational
+        return super(ZCreditTransaction, self.with_context(mail_create_nosubscribe=True)).create(vals_list)
+
+    def init(self):
+        # One processed transaction per reference, enforced by the
+        # Postgres B-tree instead of an ORM search on every submission.
+        # The 'New' placeholder (records created while no sequence was
+        # configured) is excluded, as the chunk0-5 guard did; it is not
+        # a real reference and pre-existing databases may hold several.
+        # Recreated on upgrade so predicate changes take effect
+        self.env.cr.execute("DROP INDEX IF EXISTS zcredit_transaction_name_processed_idx")
+        self.env.cr.execute("""
+            CREATE UNIQUE INDEX zcredit_transaction_name_processed_idx
+            ON zcredit_transaction (name)
+            WHERE status != 'draft' AND name != 'New'
+        """)
+        # In-flight transactions are the queried-hot subset; a partial
+        # index keeps it small regardless of the finished-row volume.
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS zcredit_transaction_status_processing_idx
+            ON zcredit_transaction (status)
+            WHERE status = 'processing'
+        """)
 
     # Validation (@api.constrains)
-    @api.constrains('amount')
-    def _check_amount(self):
-        """Validate amount is positive"""
+    @api.constrains('amount', 'card_number', 'expiry_date', 'cvv')
+    def _check_transaction_values(self):
+        """Validate amount, card number (with Luhn), expiry date and CVV.
+
+        A single constraint method means one trigger dispatch and one
+        pass over the records per write, instead of four.
+        """
+        today = date.today()
+        current_century = today.year // 100 * 100
+
         for record in self:
             if record.amount <= 0:
-                raise ValidationError(_("Transaction amount must be a positive number."))
+                raise ValidationError(_ERR_AMOUNT)
 
-    @api.constrains('card_number')
-    def _check_card_number(self):
-        """Validate card number format """
-        for record in self:
-            if not re.fullmatch(r'\d{13,19}', record.card_number.replace(' ', '')):
-                raise ValidationError(_("Invalid Card Number format. Must be 13-19 digits."))
+            # isascii() guards the ord() arithmetic below: isdigit() also
+            # accepts Unicode decimal digits, which are not valid here
+            card = record.card_number.replace(' ', '')
+            if not card.isascii() or not card.isdigit() or not (13 <= len(card) <= 19):
+                raise ValidationError(_ERR_CARD_FORMAT)
 
-    @api.constrains('expiry_date')
-    def _check_expiry_date(self):
-        """Validate expiry date format and if not expired"""
-        for record in self:
-            if not re.fullmatch(r'\d{2}/\d{2}', record.expiry_date):
-                raise ValidationError(_("Invalid Expiry Date format. Must be MM/YY."))
+            # Cheaper than the Luhn pass, and blocklisted numbers must
+            # report as stolen even when they fail the checksum
+            if card in _STOLEN_CARDS:
+                raise ValidationError(_ERR_CARD_BLOCKED)
 
-            try:
-                month_str, year_str = record.expiry_date.split('/')
-                current_century = date.today().year // 100 * 100
-                expiry_year = current_century + int(year_str)
-                expiry_month = int(month_str)
+            digits = [ord(c) - 48 for c in card]
+            checksum = sum(digits[-1::-2]) + sum(_LUHN[d] for d in digits[-2::-2])
+            if checksum % 10:
+                raise ValidationError(_ERR_CARD_LUHN)
 
-                if not (1 <= expiry_month <= 12):
-                    raise ValidationError(_("Invalid Expiry Month (must be 01-12)."))
+            s = record.expiry_date
+            if len(s) != 5 or s[2] != '/' or not s.isascii() or not (s[0:2] + s[3:5]).isdigit():
+                raise ValidationError(_ERR_EXPIRY_FORMAT)
 
-                today = date.today()
+            expiry_month = (ord(s[0]) - 48) * 10 + (ord(s[1]) - 48)
+            expiry_year = current_century + (ord(s[3]) - 48) * 10 + (ord(s[4]) - 48)
 
-                if expiry_year < today.year or (expiry_year == today.year and expiry_month < today.month):
-                    raise ValidationError(_("Card is expired."))
+            if not (1 <= expiry_month <= 12):
+                raise ValidationError(_ERR_EXPIRY_MONTH)
 
-            except ValueError:
-                raise ValidationError(_("Invalid Expiry Date format."))
+            if expiry_year < today.year or (expiry_year == today.year and expiry_month < today.month):
+                raise ValidationError(_ERR_EXPIRED)
 
-    @api.constrains('cvv')
-    def _check_cvv(self):
-        """Validate CVV format"""
-        for record in self:
-            if not re.fullmatch(r'\d{3,4}', record.cvv):
-                raise ValidationError(_("Invalid CVV. Must be 3 or 4 digits."))
+            if not record.cvv.isascii() or not record.cvv.isdigit() or not (3 <= len(record.cvv) <= 4):
+                raise ValidationError(_ERR_CVV)
+
+    def _mark_processing(self, message):
+        """Flag the records as processing before contacting the gateway.
+
+        The partial unique index on (name) rejects references that were
+        already processed, so duplicate detection costs no extra query.
+        Tracking is disabled for this transient state; only the final
+        success/failed write posts a tracked chatter message.
+        """
+        try:
+            with self.env.cr.savepoint():
+                records = self.with_context(tracking_disable=True, mail_notrack=True)
+                records.write({'status': 'processing', 'result': message})
+                records.flush_recordset(['status'])
+        except UniqueViolation:
+            raise ValidationError(_("A transaction with this reference has already been processed."))
 
     # Helper Methods for API Response Handling
 
@@ -117,16 +280,32 @@ class ZCreditTransaction(models.Model):
             }
         }
 
-    def _handle_api_response(self, response_text, http_status_code):
+    def _handle_api_response(self, response):
         """
-        Processes the API response text and updates the record.
+        Processes the gateway response and updates the record with a
+        single write per outcome.
         """
         self.ensure_one()
-        self.result = response_text
+        http_status_code = response.status_code
+        raw_text = None
 
         try:
-            response_json = json.loads(response_text)
-            self.result = json.dumps(response_json, indent=2, ensure_ascii=False)
+            if ijson is not None:
+                # Parse only the status fields from the stream; the tee
+                # keeps the raw bytes so the body is still stored and
+                # reported without building the full object tree.
+                response.raw.decode_content = True
+                tee = _TeeReader(response.raw)
+                try:
+                    response_json = {
+                        k: v for k, v in ijson.kvitems(tee, '')
+                        if k in _STATUS_FIELDS
+                    }
+                finally:
+                    raw_text = tee.text(response.encoding)
+            else:
+                raw_text = response.text
+                response_json = _loads(raw_text)
 
             # ---  Z-Credit ---
             has_error = response_json.get('HasError', True)
@@ -136,79 +315,112 @@ class ZCreditTransaction(models.Model):
             is_successful = (http_status_code == 200) and (has_error is False) and (return_code == 0)
 
             if is_successful:
-                self.status = 'success'
                 approval_num = response_json.get('ApprovalNumber', '')
+                self.write({'result': raw_text, 'status': 'success'})
                 message = _("Transaction completed successfully! Approval: %s") % approval_num
                 return self._return_notification(message, 'success')
             else:
-                self.status = 'failed'
+                # Store the body as received; prettifying is on demand
+                self.write({'result': raw_text, 'status': 'failed'})
 
                 prefix = f"Z-Credit Error ({return_code}): " if return_code is not None else "API Error: "
                 error_message = return_message or _(
                     "Transaction failed. Check the 'API Response' field for full details.")
 
-                _logger.warning("Z-Credit Transaction Failed: %s | Response: %s", self.name, response_text)
+                _logger.warning("Z-Credit Transaction Failed: %s | ReturnCode: %s | Message: %s",
+                                self.name, return_code, return_message)
                 return self._return_notification(prefix + error_message, 'danger')
 
-        except json.JSONDecodeError:
-            self.status = 'failed'
-            _logger.error("API returned non-JSON data or invalid JSON: %s", response_text)
-            self.result = _("API returned invalid data: %s") % response_text
+        except _DECODE_ERRORS:
+            # raw_text holds what the tee captured before the parse error
+            body = raw_text if raw_text is not None else response.text
+            _logger.error("API returned non-JSON data or invalid JSON: %s", body)
+            self.write({
+                'result': _("API returned invalid data: %s") % body,
+                'status': 'failed',
+            })
             return self._return_notification(_("API returned invalid data. Check result field."), 'danger')
         except Exception as e:
-            self.status = 'failed'
             _logger.error("Error handling Z-Credit response: %s", str(e))
-            self.result += f"\nInternal Parsing Error: {str(e)}"
+            self.write({
+                'result': _("Internal response handling error: %s") % str(e),
+                'status': 'failed',
+            })
             return self._return_notification(_("An unexpected error occurred during response processing."), 'danger')
 
+    def action_pretty_print_result(self):
+        """Reformat the stored raw API response for readability, on demand."""
+        for record in self.filtered('result'):
+            try:
+                record.result = _reformat_response(record.result)[0]
+            except (ValueError, TypeError):
+                continue  # not JSON (summary or error text), leave as-is
+
     # Main Transaction Method
 
+    def _build_payload(self):
+        """Build the CommitFullTransaction payload for this record."""
+        self.ensure_one()
+
+        payload = _PAYLOAD_TEMPLATE.copy()
+        payload['TerminalNumber'] = self.terminal_number
+        payload['password'] = self.terminal_password
+        payload['CardNumber'] = self.card_number.replace(' ', '')
+        payload['ExpDate_MMYY'] = self.expiry_date.replace('/', '')  # MM/YY -> MMYY
+        payload['CVV'] = self.cvv
+        payload['CardHolderName'] = self.cardholder_name
+        payload['TransactionSum'] = self.amount
+        if self.transaction_type == 'authorize':
+            payload['J'] = 5  # J=5 for Authorization (J5)
+        return payload
+
     def action_test_transaction(self):
+        """Enqueue the transaction and return immediately.
+
+        The POST to Z-Credit can block for up to 45 seconds; running it
+        in a queue_job worker keeps Odoo HTTP workers free instead of
+        having them wait on gateway latency.
+        """
         self.ensure_one()
 
-        self.status = 'processing'
-        self.result = _("Sending request to Z-Credit API...")
+        self._mark_processing(_("Queued for submission to the Z-Credit API..."))
+        self.with_delay(channel='root.zcredit')._do_post_to_zcredit()
 
-        j_parameter = 0
-        if self.transaction_type == 'authorize':
-            j_parameter = 5  # J=5 for Authorization (J5)
-
-        expiry_formatted = self.expiry_date.replace('/', '')  # MM/YY -> MMYY
-
-        payload = {
-            # Credentials
-            'TerminalNumber': self.terminal_number,
-            'password': self.terminal_password,
-            # Card Data
-            'CardNumber': self.card_number.replace(' ', ''),
-            'ExpDate_MMYY': expiry_formatted,
-            'CVV': self.cvv,
-            'CardHolderName': self.cardholder_name,
-            # Transaction Data
-            'TransactionSum': self.amount,
-            'J': j_parameter,
-        }
+        return self._return_notification(
+            _("Transaction submitted. The status will update once Z-Credit responds."), 'info')
 
-        headers = {'Content-Type': 'application/json'}
+    def _do_post_to_zcredit(self):
+        """Send the transaction to Z-Credit (runs in a queue_job worker)."""
+        self.ensure_one()
+
+        payload = self._build_payload()
+        headers = {'Content-Type': 'application/json', 'Connection': 'keep-alive'}
 
         try:
             _logger.info("Z-Credit API Request for %s: %s", self.name, payload)
 
-            response = requests.post(self.API_URL, headers=headers, json=payload, timeout=45)
+            response = _SESSION.post(self.API_URL, headers=headers, json=payload,
+                                     stream=True, timeout=45)
 
-            return self._handle_api_response(response.text, response.status_code)
+            return self._handle_api_response(response)
 
         except Timeout:
-            self.status = 'failed'
-            self.result = _("Request timed out after 45 seconds.")
+            self.write({
+                'status': 'failed',
+                'result': _("Request timed out after 45 seconds."),
+            })
             return self._return_notification(_("The API request timed out."), 'danger')
         except ConnectionError:
-            self.status = 'failed'
-            self.result = _("Connection Error: Could not reach Z-Credit gateway.")
+            self.write({
+                'status': 'failed',
+                'result': _("Connection Error: Could not reach Z-Credit gateway."),
+            })
             return self._return_notification(_("Could not connect to the Z-Credit API endpoint."), 'danger')
         except RequestException as e:
-            self.status = 'failed'
-            self.result = _("A network error occurred: %s") % str(e)
+            self.write({
+                'status': 'failed',
+                'result': _("A network error occurred: %s") % str(e),
+            })
             return self._return_notification(_("A general network error occurred."), 'danger')
         except Exception as e:
             #  ValidationError
@@ -216,7 +428,29 @@ class ZCreditTransaction(models.Model):
                 self.status = 'draft'
                 raise e
 
-            self.status = 'failed'
-            self.result = _("An unexpected internal error occurred: %s") % str(e)
+            self.write({
+                'status': 'failed',
+                'result': _("An unexpected internal error occurred: %s") % str(e),
+            })
             _logger.exception("Unexpected error during Z-Credit transaction attempt.")
-            return self._return_notification(_("An unexpected internal system error occurred."), 'danger')
\ No newline at end of file
+            return self._return_notification(_("An unexpected internal system error occurred."), 'danger')
+
+    def action_test_transactions(self):
+        """
+        Queue several transactions for submission in one action.
+
+        Z-Credit's CommitFullTransaction endpoint accepts a single
+        transaction per request, so each record gets its own queue_job
+        delayed job; gateway latency is absorbed in parallel by the job
+        workers instead of blocking the HTTP worker.
+        """
+        if not self:
+            return False
+
+        self._mark_processing(_("Queued for submission to the Z-Credit API..."))
+        for record in self:
+            record.with_delay(channel='root.zcredit')._do_post_to_zcredit()
+
+        return self._return_notification(
+            _("%(count)s transaction(s) submitted. Statuses will update as Z-Credit responds.",
+              count=len(self)), 'info')
\ No newline at end of file